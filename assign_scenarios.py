@@ -1,38 +1,61 @@
 """
 Utility library to assign error message contexts/scenarios to raters.
 
-This assumes that "sample.pickle" is present in the current working directory.
+This assumes that "sample.pickle" is present in the current working directory when
+create_assignments() is called.
 """
 
 import pickle
 from collections import defaultdict
+from functools import lru_cache
+from typing import List
 
-# Top PEM categories, in order from most frequent to least frequent
-TOP_ERRORS = [
-    ("compiler.err.premature.eof"),
-    ("';' expected"),
-    ("compiler.err.cant.resolve[variable]"),
-    ("compiler.err.illegal.start.of.expr"),
-    ("<identifier> expected"),
-    ("compiler.err.cant.resolve[method]"),
-    ("compiler.err.cant.resolve[class]"),
-    ("compiler.err.not.stmt"),
-    ("class, interface, or enum expected"),
-    ("')' expected"),
-    ("compiler.err.prob.found.req"),
-    ("compiler.err.missing.ret.stmt"),
-    ("compiler.err.cant.apply.symbol"),
-    ("compiler.err.invalid.meth.decl.ret.type.req"),
-    ("compiler.err.doesnt.exist"),
-    ("compiler.err.illegal.start.of.type"),
-    ("compiler.err.unclosed.str.lit"),
-    ("'(' expected"),
-    ("compiler.err.already.defined[variable]"),
-    ("compiler.err.illegal.start.of.stmt"),
-]
-
-with open("sample.pickle", "rb") as f:
-    ALL_SCENARIOS = pickle.load(f)
+# Top PEM categories, in order from most frequent to least frequent.
+# See TOP_ERRORS_QUERY in create-useful-database.py for how these were obtained.
+TOP_ERRORS = (
+    "compiler.err.premature.eof",
+    "';' expected",
+    "compiler.err.cant.resolve[variable]",
+    "compiler.err.illegal.start.of.expr",
+    "<identifier> expected",
+    "compiler.err.cant.resolve[method]",
+    "compiler.err.cant.resolve[class]",
+    "compiler.err.not.stmt",
+    "class, interface, or enum expected",
+    "')' expected",
+    "compiler.err.prob.found.req",
+    "compiler.err.missing.ret.stmt",
+    "compiler.err.cant.apply.symbol",
+    "compiler.err.invalid.meth.decl.ret.type.req",
+    "compiler.err.doesnt.exist",
+    "compiler.err.illegal.start.of.type",
+    "compiler.err.unclosed.str.lit",
+    "'(' expected",
+    "compiler.err.already.defined[variable]",
+    "compiler.err.illegal.start.of.stmt",
+)
+
+
+@lru_cache(maxsize=1)
+def _load_all_scenarios():
+    """
+    Loads all scenarios from sample.pickle. This is only done once, and only when
+    assignments are actually created.
+    """
+    with open("sample.pickle", "rb") as f:
+        return pickle.load(f)
+
+
+@lru_cache(maxsize=1)
+def _group_by_category():
+    """
+    Group all scenarios by PEM category. Like loading the scenarios, this is only
+    done once.
+    """
+    scenarios = defaultdict(list)
+    for scenario in _load_all_scenarios():
+        scenarios[scenario["pem_category"]].append(scenario)
+    return scenarios
 
 
 def create_assignments(top_n: int, k: int):
@@ -45,31 +68,33 @@ def create_assignments(top_n: int, k: int):
     total = top_n * k
     assert k % 3 == 0, "Number of scenarios per category must be divisible by 3 raters"
 
-    # Group all scenarios by PEM category
-    scenarios = defaultdict(list)
-    for scenario in ALL_SCENARIOS:
-        scenarios[scenario["pem_category"]].append(scenario)
+    scenarios = _group_by_category()
 
     # Time to assign scenarios to raters!
-    rater1 = []
-    rater2 = []
-    rater3 = []
+    # Rater 1 gets first 2/3
+    # Rater 2 gets last 2/3
+    # Rater 3 gets first 1/3 and last 1/3
+    # This is the same for every category, so figure out who gets what only once:
+    rater1_indices = [i for i in range(k) if i % 3 != 2]
+    rater2_indices = [i for i in range(k) if i % 3 != 0]
+    rater3_indices = [i for i in range(k) if i % 3 != 1]
+
+    rater1: List[dict] = []
+    rater2: List[dict] = []
+    rater3: List[dict] = []
     for category in TOP_ERRORS[:top_n]:
+        # Fail early (and clearly) if there are not enough scenarios in this category:
+        category_scenarios = scenarios.get(category, [])
+        n_available = len(category_scenarios)
+        assert (
+            n_available >= k
+        ), f"Need {k} scenarios of {category}, but only have {n_available}"
+
         # Retain only the top K scenarios from each category
-        for i, scenario in enumerate(scenarios[category][:k]):
-            # Rater 1 gets first 2/3
-            # Rater 2 gets last 2/3
-            # Rater 3 gets first 1/3 and last 1/3
-            third = i % 3
-            if third == 0:
-                rater1.append(scenario)
-                rater3.append(scenario)
-            elif third == 1:
-                rater1.append(scenario)
-                rater2.append(scenario)
-            else:
-                rater2.append(scenario)
-                rater3.append(scenario)
+        top_k = category_scenarios[:k]
+        rater1.extend(top_k[i] for i in rater1_indices)
+        rater2.extend(top_k[i] for i in rater2_indices)
+        rater3.extend(top_k[i] for i in rater3_indices)
 
     one_third = total // 3
     assert len(rater1) == len(rater2) == len(rater3) == one_third * 2
@@ -4,20 +4,30 @@ Utilities for interacting with Blackbox Mini.
 
 from __future__ import annotations
 
-import copy
 import os
-import xml.etree.ElementTree as ET
-from collections import defaultdict
+import xml.etree.ElementTree
 from dataclasses import dataclass
-from functools import cached_property
-from typing import List
+from functools import cached_property, lru_cache
+from typing import Dict, Iterable, List, Optional
+
+try:
+    # lxml parses srcML several times faster than the standard library, but it is not
+    # installed everywhere (e.g., on the Blackbox server), so it's optional:
+    from lxml import etree as ET  # type: ignore
+
+    USING_LXML = True
+    # Some srcML files are bigger than libxml2 allows by default, and srcML never uses
+    # xml:id, so don't bother keeping track of IDs:
+    PARSER_OPTIONS = dict(huge_tree=True, collect_ids=False)
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+    USING_LXML = False
+    PARSER_OPTIONS = {}
 
 # Unknown filename.
 UNKNOWN = "<unknown>"
 
-# TODO: get rid of this constant:
-MAX_ERRORS = 1
-
 
 @dataclass
 class JavaUnit:
@@ -30,19 +40,75 @@ class JavaUnit:
         """
         Return a Java unit from its srcml path and version.
         """
-        root = ET.parse(os.fspath(srcml_path)).getroot()
-        unit = find_requested_version(root, version)
+        return JavaUnit.from_unit(iterparse_requested_version(srcml_path, version))
 
+    @staticmethod
+    def from_path_and_versions(
+        srcml_path: os.PathLike, versions: Iterable[str]
+    ) -> Dict[str, JavaUnit]:
+        """
+        Return a mapping from version to Java unit for several versions of the same srcml
+        path. The file is only parsed once, no matter how many versions are requested.
+        """
+        versions = set(versions)
+        if len(versions) == 1:
+            # Streaming is cheaper when only one version is needed:
+            (version,) = versions
+            return {version: JavaUnit.from_path_and_version(srcml_path, version)}
+
+        # NOTE: from_unit() modifies the units, so they must NOT come from the shared,
+        # cached parse_srcml_versions():
+        index = index_versions(parse_srcml(srcml_path))
+        return {
+            version: JavaUnit.from_unit(lookup_version(index, version))
+            for version in versions
+        }
+
+    @staticmethod
+    def from_unit(unit: ET.Element) -> JavaUnit:
+        """
+        Return a Java unit from a parsed <unit> element. Note: this removes the compiler
+        errors from the element!
+        """
         filename = determine_file_name(unit)
 
         # Get rid of the compiler errors, but add them to our data structure.
-        pems = []
-        for pem_element in unit.findall("./compile-error"):
-            pems.append(JavaCompilerError.from_element(pem_element, filename))
-            unit.remove(pem_element)
+        pems = [
+            JavaCompilerError.from_element(pem_element, filename)
+            for pem_element in remove_compiler_errors(unit)
+        ]
 
         return JavaUnit(unit=unit, filename=filename, pems=pems)
 
+    def __getstate__(self):
+        # lxml elements cannot be pickled, so pickle the unit as serialized XML instead:
+        state = self.__dict__.copy()
+        if "_unit_xml" in state:
+            # Never parsed, so the XML we were unpickled from can be reused as is:
+            state["unit"] = state.pop("_unit_xml")
+        elif USING_LXML and not ET.iselement(self.unit):
+            # Old pickles might contain xml.etree elements, which lxml cannot serialize:
+            state["unit"] = xml.etree.ElementTree.tostring(self.unit)
+        else:
+            state["unit"] = ET.tostring(self.unit)
+        return state
+
+    def __setstate__(self, state):
+        # Older pickles contain the unit as an (xml.etree) element, so only parse bytes.
+        # Parsing every unit in a pickle is slow, and most callers only look at a few of
+        # them, so wait until the unit is actually needed (see __getattr__):
+        if isinstance(state["unit"], bytes):
+            state = dict(state)
+            state["_unit_xml"] = state.pop("unit")
+        self.__dict__.update(state)
+
+    def __getattr__(self, name: str):
+        # Only called when the attribute does not exist, i.e., the unit is not parsed yet:
+        if name != "unit" or "_unit_xml" not in self.__dict__:
+            raise AttributeError(name)
+        self.unit = ET.fromstring(self.__dict__.pop("_unit_xml"))
+        return self.unit
+
     @cached_property
     def source_code(self) -> str:
         # Need to add empty lines before the first actual line number in the file, or else the
@@ -50,7 +116,7 @@ class JavaUnit:
         first_line_number = determine_first_line_number(self.unit)
         preceding_empty_lines = "\n" * (first_line_number - 1)
 
-        source_code = preceding_empty_lines + "".join(self.unit.itertext())
+        source_code = preceding_empty_lines + get_text(self.unit)
         return source_code
 
 
@@ -60,6 +126,9 @@ class JavaCompilerError:
     A programming error message, as recorded by BlueJ and javac.
     """
 
+    # There can be a lot of these, so don't give each one a __dict__:
+    __slots__ = ("filename", "text", "start", "end")
+
     filename: str
     text: str
     start: Position
@@ -68,6 +137,9 @@ class JavaCompilerError:
     def __str__(self) -> str:
         return f"{self.filename}:{self.start.line}: error: {self.text}"
 
+    def __setstate__(self, state):
+        _set_slots_from_pickle(self, state)
+
     @property
     def fixed_error_message_text(self) -> str:
         r"""
@@ -93,33 +165,164 @@ class Position:
     A position in the source code file.
     """
 
+    __slots__ = ("line", "column")
+
     line: int
     column: int
 
     @classmethod
     def from_attribute(cls, attribute: str) -> Position:
         "Parse a position from either an start='' or end='' XML attribute."
-        return cls(*(int(x) for x in attribute.split(":")))
+        line, column = attribute.split(":", 1)
+        return cls(int(line), int(column))
+
+    def __setstate__(self, state):
+        _set_slots_from_pickle(self, state)
+
+
+def _set_slots_from_pickle(obj, state) -> None:
+    """
+    Restores a pickled object that uses __slots__. Pickles made before __slots__ were
+    added store the attributes in a plain dictionary, so both kinds of state work.
+    """
+    if isinstance(state, tuple):
+        # (__dict__, __slots__) state -- there is no __dict__!
+        _, state = state
+    for name, value in state.items():
+        setattr(obj, name, value)
+
+
+def parse_srcml(srcml_path: os.PathLike | str):
+    """
+    Parse a srcML file from Blackbox Mini and return its root element.
+    """
+    # Parsing from a binary file object lets lxml read the file in large chunks:
+    with open(srcml_path, "rb") as srcml_file:
+        return ET.parse(srcml_file, ET.XMLParser(**PARSER_OPTIONS)).getroot()
+
+
+# srcML files can get pretty big, so only keep a few of them around:
+@lru_cache(maxsize=16)
+def parse_srcml_versions(srcml_path: os.PathLike | str) -> Dict[str, ET.Element]:
+    """
+    Parse a srcML file from Blackbox Mini and return a mapping from version to <unit>.
+
+    The parsed units are cached and SHARED between callers, so do not modify them!
+    """
+    return index_versions(parse_srcml(srcml_path))
+
+
+def index_versions(root) -> Dict[str, ET.Element]:
+    "Returns a mapping from version to <unit> of a parsed srcML file."
+    versions: Dict[str, ET.Element] = {}
+    for unit in root.iterfind("./unit"):
+        # If a version is (somehow) duplicated, the first one wins:
+        versions.setdefault(unit.attrib["version"], unit)
+    return versions
 
 
 def find_requested_version(root, version: str):
-    versions_available = []
+    return lookup_version(index_versions(root), version)
+
+
+def lookup_version(versions: Dict[str, ET.Element], version: str):
+    "Returns the unit for the given version from an index of versions."
+    try:
+        return versions[version]
+    except KeyError:
+        raise version_not_found(version, list(versions)) from None
 
-    for unit in root.findall("./unit"):
-        unit_version = unit.attrib["version"]
-        if version == unit_version:
-            return unit
-        versions_available.append(unit_version)
 
+def version_not_found(version: str, versions_available: List[str]) -> KeyError:
     # TODO: return a module internal error for this:
-    raise KeyError(
+    return KeyError(
         f"Could not find version {version}. Versions available: {versions_available}"
     )
 
 
+def iterparse_requested_version(srcml_path: os.PathLike | str, version: str):
+    """
+    Same as find_requested_version(), but streams the srcML file instead of building
+    the entire tree first. Versions that were not requested are thrown away as soon as
+    they are parsed, so only the requested <unit> is ever kept in memory.
+    """
+    versions_available = []
+    depth = 0
+
+    with open(srcml_path, "rb") as srcml_file:
+        events = ET.iterparse(srcml_file, events=("start", "end"), **PARSER_OPTIONS)
+        for event, element in events:
+            if event == "start":
+                if depth == 0:
+                    root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            # Only consider the <unit> elements directly underneath the root:
+            if depth != 1 or element.tag != "unit":
+                continue
+
+            unit_version = element.attrib["version"]
+            if version == unit_version:
+                return element
+            versions_available.append(unit_version)
+
+            # Free this unit, and any previous unit, since it's not the one we want:
+            element.clear()
+            del root[:-1]
+
+    raise version_not_found(version, versions_available)
+
+
+def remove_compiler_errors(unit) -> List[ET.Element]:
+    """
+    Removes all <compile-error> elements from the unit in a single pass, and returns
+    the removed elements in document order.
+    """
+    pem_elements = []
+    other_elements = []
+    for child in unit:
+        if child.tag == "compile-error":
+            pem_elements.append(child)
+        else:
+            other_elements.append(child)
+
+    unit[:] = other_elements
+    return pem_elements
+
+
+def get_text(unit) -> str:
+    "Returns all of the text within the unit, i.e., its source code."
+    # Old pickles might contain xml.etree elements, even when lxml is installed:
+    if USING_LXML and ET.iselement(unit):
+        # lxml can collect all the text in C, which is faster than using itertext():
+        return ET.tostring(unit, method="text", encoding="unicode", with_tail=False)
+    return "".join(unit.itertext())
+
+
+def get_text_without_compiler_errors(unit) -> str:
+    """
+    Same as get_text() on a unit whose compiler errors have been removed, but without
+    having to modify (or copy) the unit.
+    """
+    parts = [unit.text or ""]
+    for child in unit:
+        # Removing a <compile-error> also removes the text after it, so skip both:
+        if child.tag == "compile-error":
+            continue
+        # lxml also has comments and processing instructions, which contain no code:
+        if isinstance(child.tag, str):
+            parts.append(get_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
 def determine_first_line_number(unit):
+    # The unit might still contain its compiler errors -- those are not source code:
+    source_elements = (child for child in unit if child.tag != "compile-error")
     try:
-        first_element = next(iter(unit))
+        first_element = next(source_elements)
     except StopIteration:
         # The file is empty. Just pretend the file starts on line 1.
         return 1
@@ -153,55 +356,45 @@ def determine_file_name(unit):
 
 
 def show_file(filename: str, version: str):
-    root = ET.parse(filename).getroot()
-    unit = find_requested_version(root, version)
-    unit_with_compiler_errors = copy.deepcopy(unit)
+    # The parsed tree is cached, so it must not be modified!
+    unit = lookup_version(parse_srcml_versions(filename), version)
     filename = determine_file_name(unit)
 
-    # Get rid of the compiler errors from the version we want to print:
-    for pem in unit.findall("./compile-error"):
-        unit.remove(pem)
-
-    pems_per_line = defaultdict(list)
-
-    # Group PEMs per each source line of code that they're on
-    pems_seen = 0
-    pems = unit_with_compiler_errors.findall("./compile-error")
-    for pem_element in pems:
+    # Only show the top error:
+    pem_element = unit.find("./compile-error")
+    pem: Optional[JavaCompilerError]
+    if pem_element is not None:
         pem = JavaCompilerError.from_element(pem_element, filename)
-        pems_per_line[pem.start.line].append(pem)
-        pems_seen += 1
-        if pems_seen >= MAX_ERRORS:
-            break
+        pem_line_no = pem.start.line
+    else:
+        pem = None
+        pem_line_no = None
 
     # Need to add empty lines before the first actual line number in the file, or else the
     # line numbering will be off.
     first_line_number = determine_first_line_number(unit)
     preceding_empty_lines = [""] * (first_line_number - 1)
 
-    source_code = "".join(unit.itertext())
+    source_code = get_text_without_compiler_errors(unit)
     source_lines = preceding_empty_lines + source_code.splitlines()
 
     biggest_line_no_width = len(str(len(source_lines)))
+    # The width of the gutter is the same for every line, so only build the format once:
+    format_line = f"{{:>{biggest_line_no_width}}} | {{}}".format
+    margin = " " * biggest_line_no_width
 
     for line_no, line in enumerate(source_lines, start=1):
-        pems = pems_per_line.get(line_no)
-        if pems is not None:
-            pem = pems[0]
-        else:
-            pem = None
-
-        if pem:
-            pem.print()
-
-        print(f"{line_no:>{biggest_line_no_width}} | {line}")
-
-        if not pem:
+        if line_no != pem_line_no:
+            print(format_line(line_no, line))
             continue
 
+        # There's only a PEM line when there's a PEM:
+        assert pem is not None
+        print(pem)
+        print(format_line(line_no, line))
+
         # columns are 1-indexed (annoyingly):
         padding = (pem.start.column - 1) * " "
-        margin = " " * biggest_line_no_width
 
         if pem.start.line == pem.end.line:
             marker = "^" * max(1, pem.end.column - pem.start.column)
@@ -215,19 +408,14 @@ def get_source_code(xml_filename: str, version: str):
     """
     Gets the source code for a filename and version from Blackbox mini.
     """
-    root = ET.parse(xml_filename).getroot()
-    unit = find_requested_version(root, version)
-    unit_with_compiler_errors = copy.deepcopy(unit)
+    # The parsed tree is cached, so it must not be modified!
+    unit = lookup_version(parse_srcml_versions(xml_filename), version)
     filename = determine_file_name(unit)
 
-    # Get rid of the compiler errors from the version we want to print:
-    for pem in unit.findall("./compile-error"):
-        unit.remove(pem)
-
     # Need to add empty lines before the first actual line number in the file, or else the
     # line numbering will be off.
     first_line_number = determine_first_line_number(unit)
     preceding_empty_lines = [""] * (first_line_number - 1)
 
-    source_code = "".join(unit.itertext())
+    source_code = get_text_without_compiler_errors(unit)
     return source_code, filename
@@ -67,30 +67,40 @@ with conn:
         """
     )
     conn.executemany("INSERT INTO pilot_set VALUES (?, ?)", pilot_set)
+    # Index the pilot set so that the joins below can probe it:
+    conn.execute("CREATE UNIQUE INDEX pilot_set_idx ON pilot_set(srcml_path, version)")
 
 
-# Okay, add all the answers to their respective tables
-for database_path in databases:
+# Attach ALL the databases first: you can't ATTACH in the middle of a transaction, and
+# we want to copy all of the answers in one transaction.
+schema_names = []
+for i, database_path in enumerate(databases, start=1):
     print(f"Attaching to {database_path}...")
-    conn.execute(f"ATTACH DATABASE '{database_path}' AS other")
+    schema_name = f"rater{i}"
+    conn.execute(f"ATTACH DATABASE '{database_path}' AS {schema_name}")
+    schema_names.append(schema_name)
 
-    with conn:
-        # Full set:
+# Okay, add all the answers to their respective tables
+with conn:
+    for schema_name in schema_names:
+        # Full set (anti-join: the answers that are NOT in the pilot set):
         conn.execute(
-            """
-            INSERT INTO answers SELECT * FROM other.answers
-            WHERE (srcml_path, version) NOT IN (SELECT * FROM pilot_set)
+            f"""
+            INSERT INTO answers SELECT other_answers.* FROM {schema_name}.answers AS other_answers
+              LEFT JOIN pilot_set USING (srcml_path, version)
+             WHERE pilot_set.srcml_path IS NULL
             """
         )
         # Pilot set:
         conn.execute(
-            """
-            INSERT INTO pilot_set_answers SELECT * FROM other.answers
-            WHERE (srcml_path, version) IN (SELECT * FROM pilot_set)
+            f"""
+            INSERT INTO pilot_set_answers SELECT other_answers.* FROM {schema_name}.answers AS other_answers
+              JOIN pilot_set USING (srcml_path, version)
             """
         )
 
-    conn.execute("DETACH other")
+for schema_name in schema_names:
+    conn.execute(f"DETACH {schema_name}")
 
 COUNT_OF_ANSWERS = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
 assert COUNT_OF_ANSWERS >= N_RATERS * N_RESPONSES
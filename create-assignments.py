@@ -30,16 +30,20 @@ import argparse
 from assign_scenarios import create_assignments
 
 
+def as_tsv_line(scenario) -> str:
+    pem_category = scenario["pem_category"]
+    srcml_path = scenario["xml_filename"]
+    version = scenario["version"]
+    return f"{pem_category}\t{srcml_path}\t{version}\n"
+
+
 def save_assignments(rater1, rater2, rater3):
     for assignments, name in zip(
         [rater1, rater2, rater3], ["eddie", "prajish", "brett"]
     ):
+        # Write the entire file in one go:
         with open(f"{name}-assignments.tsv", "w") as f:
-            for scenario in assignments:
-                pem_category = scenario["pem_category"]
-                srcml_path = scenario["xml_filename"]
-                version = scenario["version"]
-                f.write(f"{pem_category}\t{srcml_path}\t{version}\n")
+            f.write("".join(as_tsv_line(scenario) for scenario in assignments))
 
 
 parser = argparse.ArgumentParser()
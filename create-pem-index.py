@@ -32,13 +32,12 @@ SEE ALSO:
 """
 
 import pickle
+import pickletools
 import sqlite3
-from collections import defaultdict
+from typing import Dict, Set, Tuple
 
 conn = sqlite3.connect("useful.sqlite3")
 
-pem_to_paths = defaultdict(set)
-
 cur = conn.execute(
     """
     SELECT COALESCE(javac_name, sanitized_text) as identifier,
@@ -48,8 +47,11 @@ cur = conn.execute(
 """
 )
 
+# Categories stay in the order they first appear in the database:
+pem_to_paths: Dict[str, Set[Tuple[str, int]]] = {}
 for identifier, srcml_path, version in cur:
-    pem_to_paths[identifier].add((srcml_path, version))
+    pem_to_paths.setdefault(identifier, set()).add((srcml_path, version))
 
 with open("pem-index.pickle", "wb") as f:
-    pickle.dump(pem_to_paths, f)
+    # Protocol 5 + optimize() makes for a smaller pickle that's faster to load:
+    f.write(pickletools.optimize(pickle.dumps(pem_to_paths, protocol=5)))
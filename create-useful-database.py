@@ -18,6 +18,7 @@ OUTPUTS:
 
 import sqlite3
 
+from assign_scenarios import TOP_ERRORS
 from project_antipatterns.enrich_database import register_helpers
 
 SCHEMA = """
@@ -41,32 +42,8 @@ CREATE TABLE top_messages(
 );
 """
 
-# Top first error messages (see query below)
-TOP_ERRORS = [
-    (1, "compiler.err.premature.eof"),
-    (2, "';' expected"),
-    (3, "compiler.err.cant.resolve[variable]"),
-    (4, "compiler.err.illegal.start.of.expr"),
-    (5, "<identifier> expected"),
-    (6, "compiler.err.cant.resolve[method]"),
-    (7, "compiler.err.cant.resolve[class]"),
-    (8, "compiler.err.not.stmt"),
-    (9, "class, interface, or enum expected"),
-    (10, "')' expected"),
-    (11, "compiler.err.prob.found.req"),
-    (12, "compiler.err.missing.ret.stmt"),
-    (13, "compiler.err.cant.apply.symbol"),
-    (14, "compiler.err.invalid.meth.decl.ret.type.req"),
-    (15, "compiler.err.doesnt.exist"),
-    (16, "compiler.err.illegal.start.of.type"),
-    (17, "compiler.err.unclosed.str.lit"),
-    (18, "'(' expected"),
-    (19, "compiler.err.already.defined[variable]"),
-    (20, "compiler.err.illegal.start.of.stmt"),
-]
-
 # How to obtain the top error messages. Note: we don't run this query because it takes forever,
-# so I hard-coded the results above.
+# so I hard-coded the results in assign_scenarios.TOP_ERRORS.
 TOP_ERRORS_QUERY = """
 SELECT sanitized_text,
        coalesce(javac_name, sanitized_text) as identifier,
@@ -89,7 +66,7 @@ conn.executescript(SCHEMA)
 with conn:
     conn.executemany(
         "INSERT INTO top_messages VALUES (?, ?)",
-        TOP_ERRORS,
+        enumerate(TOP_ERRORS, start=1),
     )
 
 conn.execute('ATTACH DATABASE "errors.sqlite3" AS original')
@@ -98,15 +75,33 @@ conn.execute('ATTACH DATABASE "errors.sqlite3" AS original')
 register_helpers(conn)
 
 with conn:
+    # The same message text occurs MANY times, so call the (Python) helpers only once per
+    # distinct text, rather than for every row (twice!):
+    conn.execute(
+        """
+        CREATE TEMPORARY TABLE first_message_texts AS
+            SELECT text,
+                   sanitize_message(text) AS sanitized_text,
+                   parameterized_javac_name(text) AS javac_name
+            FROM (SELECT DISTINCT text FROM original.messages WHERE rank = 1)
+        """
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX temp.first_message_texts_idx ON first_message_texts(text)"
+    )
     # INSERT OR IGNORE because there is ONE duplicate srcml_path, version pair
     # Namely /data/mini/srcml-2013-06/project-4425/src-12277.xml version 209269
+    # (ORDER BY rowid so that the same one is kept as always).
     conn.execute(
         """
         INSERT OR IGNORE INTO messages
-            SELECT srcml_path, version, start, end, text, sanitize_message(text), parameterized_javac_name(text)
-            FROM original.messages JOIN top_messages
-                ON top_messages.identifier = COALESCE(parameterized_javac_name(text), sanitize_message(text))
+            SELECT srcml_path, version, start, end, text, sanitized_text, javac_name
+            FROM original.messages
+                JOIN first_message_texts USING (text)
+                JOIN top_messages
+                    ON top_messages.identifier = COALESCE(javac_name, sanitized_text)
             WHERE original.messages.rank = 1
+            ORDER BY original.messages.rowid
         """
     )
 
@@ -2,6 +2,29 @@
 Additional utilities for the data analysis. These can be debugged separately.
 """
 
+from bisect import bisect_right
+
+# Each convention for labelling agreement splits [0, 1] into a few buckets.
+# Each bucket is [threshold, next threshold), except for the last bucket, which includes 1.
+# The thresholds are the lower bounds of every bucket but the first.
+
+# Cichetti & Sparrow, 1981
+CICHETTI_AND_SPARROW = ((0.4, 0.6, 0.75), ("Poor", "Fair", "Good", "Excellent"))
+# Fleiss, 1981
+FLEISS = ((0.4, 0.75), ("Poor", "Intermediate", "Excellent"))
+# Landis & Koch, 1977
+LANDIS_AND_KOCH = (
+    (0.2, 0.4, 0.6, 0.8),
+    ("Slight", "Fair", "Moderate", "Substantial", "Almost Perfect"),
+)
+# Regier et al., 2012
+REGIER = (
+    (0.2, 0.4, 0.6, 0.8),
+    ("Unacceptable", "Questionable", "Good", "Very Good", "Excellent"),
+)
+
+ALL_CONVENTIONS = (CICHETTI_AND_SPARROW, FLEISS, LANDIS_AND_KOCH, REGIER)
+
 
 def agreement_as_label(kappa):
     """
@@ -12,53 +35,30 @@ def agreement_as_label(kappa):
     See https://commons.wikimedia.org/wiki/File:Comparison_of_rubrics_for_evaluating_inter-rater_kappa_(and_intra-class_correlation)_coefficients.png
     """
 
-    labels = set()
-
     assert 0 <= kappa <= 1
 
-    # Cichetti & Sparrow, 1981
-    if 0 <= kappa < 0.4:
-        labels.add("Poor")
-    elif 0.4 <= kappa < 0.6:
-        labels.add("Fair")
-    elif 0.6 <= kappa < 0.75:
-        labels.add("Good")
-    elif 0.75 <= kappa <= 1:
-        labels.add("Excellent")
-
-    # Fleiss, 1981
-    if 0 <= kappa < 0.4:
-        labels.add("Poor")
-    elif 0.4 <= kappa < 0.75:
-        labels.add("Intermediate")
-    elif 0.75 <= kappa <= 1:
-        labels.add("Excellent")
-
-    # Landis & Koch, 1977
-    if 0 <= kappa < 0.2:
-        labels.add("Slight")
-    elif 0.2 <= kappa < 0.4:
-        labels.add("Fair")
-    elif 0.4 <= kappa < 0.6:
-        labels.add("Moderate")
-    elif 0.6 <= kappa < 0.8:
-        labels.add("Substantial")
-    elif 0.8 <= kappa <= 1:
-        labels.add("Almost Perfect")
-
-    # Regier et al., 2012
-    if 0 <= kappa < 0.2:
-        labels.add("Unacceptable")
-    elif 0.2 <= kappa < 0.4:
-        labels.add("Questionable")
-    elif 0.4 <= kappa < 0.6:
-        labels.add("Good")
-    elif 0.6 <= kappa < 0.8:
-        labels.add("Very Good")
-    elif 0.8 <= kappa <= 1:
-        labels.add("Excellent")
-
-    return labels
+    return {
+        labels[bisect_right(thresholds, kappa)]
+        for thresholds, labels in ALL_CONVENTIONS
+    }
+
+
+def agreement_as_labels(kappas):
+    """
+    Same as agreement_as_label(), but for an entire array (or Series) of kappas at once.
+    Returns a list of sets of labels, one per kappa.
+    """
+    import numpy as np
+
+    kappas = np.asarray(kappas)
+    assert ((0 <= kappas) & (kappas <= 1)).all()
+
+    # For each convention, look up the label of every kappa in one go:
+    labels_per_convention = [
+        np.asarray(labels)[np.searchsorted(thresholds, kappas, side="right")]
+        for thresholds, labels in ALL_CONVENTIONS
+    ]
+    return [{str(label) for label in labels} for labels in zip(*labels_per_convention)]
 
 
 def landis_and_koch_label(kappa):
@@ -67,15 +67,8 @@ def landis_and_koch_label(kappa):
 
     Derived on Landis & Koch, 1977, who themselves state that the labels are arbitrary.
     """
-    if 0 <= kappa < 0.2:
-        return "Slight"
-    elif 0.2 <= kappa < 0.4:
-        return "Fair"
-    elif 0.4 <= kappa < 0.6:
-        return "Moderate"
-    elif 0.6 <= kappa < 0.8:
-        return "Substantial"
-    elif 0.8 <= kappa <= 1:
-        return "Almost Perfect"
-
-    raise ValueError(f"Kappa out of range: {kappa}")
+    if not 0 <= kappa <= 1:
+        raise ValueError(f"Kappa out of range: {kappa}")
+
+    thresholds, labels = LANDIS_AND_KOCH
+    return labels[bisect_right(thresholds, kappa)]
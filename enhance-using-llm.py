@@ -13,7 +13,9 @@ DESCRIPTION:
     To avoid hurting our bank account, this script actively avoids enhancing the
     same PEM twice. This is accomplished by storing the enhanced PEMs in a
     nested directory structure, and checking if the API call has already been
-    issued before making it.
+    issued before making it. Additionally, every response to a deterministic
+    (temperature=0) request is cached in llm_cache/, keyed by the content of the
+    request, so the exact same request is never paid for twice.
 
 ENVIRONMENT VARIABLES:
     OPENAI_API_KEY -- a valid API key for OpenAI. Hint! Store this in the .env file!
@@ -28,24 +30,39 @@ OUTPUTS:
         error-with-context/
             {n}-{message_id}/
                 {k}-{src}-{version}.json
+    llm_cache/ -- raw API responses, keyed by the SHA-256 of the request
+        {xx}/{sha256}.json
 
 SEE ALSO:
     pickle-llm-results.py -- pickle the directory structure in one easy-to-share file!
 """
 
+import asyncio
+import hashlib
 import json
 import logging
 import os
 import pickle
+import random
 import sys
+import tempfile
+import time
+from functools import lru_cache
 from itertools import groupby
+from operator import itemgetter
 from pathlib import Path, PurePosixPath
+from typing import Any, Dict, List, Set, Tuple
 
+import aiohttp
 import openai
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-from blackbox_mini import JavaCompilerError
+try:
+    # orjson is a lot faster at writing JSON, but it's not required:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
 
 # Adapated from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
 # Intereting quote:
@@ -58,6 +75,17 @@ MODEL = "gpt-4"
 # I will arbitrarily set the maximum length to the size of the largest prompt that fit under the limit:
 MAX_SOURCE_CODE_LENGTH = 13919
 
+# How many API calls can be in flight at once. Most of the time is spent waiting on the
+# network, but let's not go overboard with GPT-4's rate limits:
+MAX_CONCURRENT_REQUESTS = 8
+
+# Stay under the account's rate limits, rather than hitting them and backing off.
+# See https://platform.openai.com/account/rate-limits
+MAX_REQUESTS_PER_MINUTE = 200
+MAX_TOKENS_PER_MINUTE = 40_000
+# ...but if we get rate limited anyway, try again (with exponential backoff) this many times:
+MAX_RETRIES = 6
+
 # API key should be stored in .env or otherwise passed in as an environment variable:
 load_dotenv()
 
@@ -72,57 +100,68 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # All PEM categories whose messages have placeholders and are thus, context-sensitive.
-CATEGORIES_WITH_PLACEHOLDERS = [
-    # "cannot find symbol - variable <x>"
-    "compiler.err.cant.resolve[variable]",
-    # NOTE: BlueJ actually enhances THESE messages, so they are not strictkly javac
-    # error messages:
-    # "cannot find symbol -   method <x>)[; maybe you meant: <y>]"
-    "compiler.err.cant.resolve[method]",
-    # cannot find symbol -   class <x>
-    "compiler.err.cant.resolve[class]",
-    # "incompatible types: <x> cannot be converted to <y>"
-    # or
-    # "incompatible types: unexpected return value"
-    "compiler.err.prob.found.req",
-    # "<construct> <name> in <scope> cannot be applied to given types; ..."
-    "compiler.err.cant.apply.symbol",
-    # "package <Y>.util does not exist"
-    "compiler.err.doesnt.exist",
-    # "variable <X> is already defined in <y>"
-    "compiler.err.already.defined[variable]",
-]
-
-
-def make_prompt_with_context(code: str, error: JavaCompilerError) -> str:
+CATEGORIES_WITH_PLACEHOLDERS = frozenset(
+    [
+        # "cannot find symbol - variable <x>"
+        "compiler.err.cant.resolve[variable]",
+        # NOTE: BlueJ actually enhances THESE messages, so they are not strictkly javac
+        # error messages:
+        # "cannot find symbol -   method <x>)[; maybe you meant: <y>]"
+        "compiler.err.cant.resolve[method]",
+        # cannot find symbol -   class <x>
+        "compiler.err.cant.resolve[class]",
+        # "incompatible types: <x> cannot be converted to <y>"
+        # or
+        # "incompatible types: unexpected return value"
+        "compiler.err.prob.found.req",
+        # "<construct> <name> in <scope> cannot be applied to given types; ..."
+        "compiler.err.cant.apply.symbol",
+        # "package <Y>.util does not exist"
+        "compiler.err.doesnt.exist",
+        # "variable <X> is already defined in <y>"
+        "compiler.err.already.defined[variable]",
+    ]
+)
+
+
+# The prompt from Leinonen et al. 2022, Prompt 3.2.1, split around the code and the error:
+PROMPT_WITH_CONTEXT_PREFIX = "Code:\n```\n"
+PROMPT_WITH_CONTEXT_MIDDLE = "\n```\n\nOutput:\n```\n"
+PROMPT_WITH_CONTEXT_SUFFIX = (
+    "\n```\n"
+    "Plain English explanation of why running the above code causes an error and how to fix the problem"
+)
+
+
+def make_prompt_with_context(code: str, error_message: str) -> str:
     """
     Uses the prompt from Leinonen et al. 2022, Prompt 3.2.1 to enhance an error message.
     """
 
-    return (
-        "Code:\n"
-        "```\n"
-        f"{code}\n"
-        "```\n"
-        "\n"
-        "Output:\n"
-        "```\n"
-        f"{error!s}\n"
-        "```\n"
-        "Plain English explanation of why running the above code causes an error and how to fix the problem"
+    # The code can be pretty long, so join everything in one go:
+    return "".join(
+        (
+            PROMPT_WITH_CONTEXT_PREFIX,
+            code,
+            PROMPT_WITH_CONTEXT_MIDDLE,
+            error_message,
+            PROMPT_WITH_CONTEXT_SUFFIX,
+        )
     )
 
 
-def make_prompt_for_error(error: JavaCompilerError) -> str:
+# NOTE: each error message gets its own request on purpose. Packing several messages into
+# one prompt would save requests, but then the model's explanation of one message could be
+# influenced by the others, and the prompt would no longer be the one we report.
+@lru_cache(maxsize=4096)
+def make_prompt_for_error(error_text: str) -> str:
     """
-    Creates a prompt only for the Java error message.
+    Creates a prompt only for the Java error message (given as just its text).
+    Many scenarios share the exact same error text, so the prompts are memoized.
     """
 
-    return f"Plain English explanation of this error message: {error.text}"
-
+    return f"Plain English explanation of this error message: {error_text}"
 
-with open("sample.pickle", "rb") as f:
-    ALL_SCENARIOS = pickle.load(f)
 
 # Ensure the directory structure exists:
 HERE = Path(__file__).parent.resolve()
@@ -132,28 +171,46 @@ ERROR_ONLY_DIR = LLM_DIR / "error-only"
 ERROR_ONLY_DIR.mkdir(exist_ok=True)
 ERROR_WITH_CONTEXT_DIR = LLM_DIR / "error-with-context"
 ERROR_WITH_CONTEXT_DIR.mkdir(exist_ok=True)
+LLM_CACHE_DIR = HERE / "llm_cache"
+
+by_pem_category = itemgetter("pem_category")
 
 
-def by_pem_category(scenario):
-    return scenario["pem_category"]
+@lru_cache(maxsize=1)
+def scenarios_by_category():
+    """
+    Loads sample.pickle and groups (and names) its categories. This is only done once,
+    for both collect_* functions, and only when responses are actually collected.
+
+    NOTE: sample.pickle is already in order of PEM category. DON'T sort it! The rank (n) of
+    each category is part of the file names in llm/, so it must stay the same between runs.
+    """
+    with open("sample.pickle", "rb") as f:
+        all_scenarios = pickle.load(f)
+
+    return [
+        (f"{n:02d}-{category}", category, list(group))
+        for n, (category, group) in enumerate(
+            groupby(all_scenarios, key=by_pem_category), start=1
+        )
+    ]
 
 
-def collect_error_only_responses() -> None:
+async def collect_error_only_responses() -> None:
     """
     Collect responses from OpenAI for **JUST** the error messages.
 
     This requires fewer API calls than collecting responses for the error with context.
     """
 
-    for n, k, category, scenario in tqdm(
-        numbererd_scenarios(), total=len(ALL_SCENARIOS)
-    ):
+    already_collected = existing_json_files(ERROR_ONLY_DIR)
+    # Maps the JSON file we'll write to the request that we need to make:
+    pending_requests: Dict[Path, Dict[str, Any]] = {}
+    for category_name, k, category, scenario in error_only_scenarios():
         # Annoyingly, I started calling the scrml_path "xml_filename" while creating a sample:
         srcml_path = scenario["xml_filename"]
         version = scenario["version"]
 
-        # Figure out the name first.
-        category_name = f"{n:02d}-{category}"
         if category in CATEGORIES_WITH_PLACEHOLDERS:
             subdirectory = ERROR_ONLY_DIR / category_name
             subdirectory.mkdir(exist_ok=True)
@@ -164,119 +221,324 @@ def collect_error_only_responses() -> None:
             json_path = ERROR_ONLY_DIR / json_filename
 
         # Skip if we've already collected this response:
-        if json_path.exists():
+        if json_path in already_collected:
             continue
 
-        pem = scenario["unit"].pems[0]
+        error_text = scenario["unit"].pems[0].text
 
         request = dict(
             model=MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": make_prompt_for_error(pem)},
+                {"role": "user", "content": make_prompt_for_error(error_text)},
             ],
             temperature=0,
         )
 
-        response = openai.ChatCompletion.create(**request)
-
-        with json_path.open(mode="w") as json_file:
-            # Provide enough information to reconstruct the original scenario:
-            json.dump(
-                dict(
-                    type="error-with-context",
-                    # Although these results are (sort of) independent of the exact
-                    # source file and error, it's useful to know exactly which file
-                    # induced this error, particularly for the error messages that have
-                    # an identifier in them, e.g., cannot find symbol  -  variable foo
-                    srcml_path=srcml_path,
-                    version=version,
-                    pem_category=category,
-                    request=request,
-                    response=response.to_dict(),
-                ),
-                json_file,
-            )
+        # Provide enough information to reconstruct the original scenario:
+        record = dict(
+            type="error-with-context",
+            # Although these results are (sort of) independent of the exact
+            # source file and error, it's useful to know exactly which file
+            # induced this error, particularly for the error messages that have
+            # an identifier in them, e.g., cannot find symbol  -  variable foo
+            srcml_path=srcml_path,
+            version=version,
+            pem_category=category,
+            request=request,
+        )
+        pending_requests[json_path] = record
+
+    await fetch_responses(pending_requests)
 
 
-def collect_error_with_context_responses() -> None:
+async def collect_error_with_context_responses() -> None:
     """
     Collect responses from OpenAI for the error messages with its code context.
     """
 
-    for n, k, category, scenario in tqdm(
-        numbererd_scenarios(), total=len(ALL_SCENARIOS)
-    ):
-        code = scenario["unit"].source_code
-        pem = scenario["unit"].pems[0]
+    already_collected = existing_json_files(ERROR_WITH_CONTEXT_DIR)
+    # Maps the JSON file we'll write to the request that we need to make:
+    pending_requests: Dict[Path, Dict[str, Any]] = {}
+    for category_name, k, category, scenario in numbererd_scenarios():
+        unit = scenario["unit"]
+        code = unit.source_code
+        error_message = str(unit.pems[0])
 
         srcml_path = scenario["xml_filename"]
         version = scenario["version"]
 
-        subdirectory_name = f"{n:02d}-{category}"
-        subdirectory = ERROR_WITH_CONTEXT_DIR / subdirectory_name
-        subdirectory.mkdir(exist_ok=True)
-
+        subdirectory = ERROR_WITH_CONTEXT_DIR / category_name
         base_srcml_name = PurePosixPath(srcml_path).stem
         json_path = subdirectory / f"{k:02d}-{base_srcml_name}-{version}.json"
 
-        # Skip if we've already collected this response:
-        if json_path.exists():
-            continue
-
-        # Skip source code contexts that are way too big:
+        # Skip source code contexts that are way too big (before touching the disk):
         if len(code) > MAX_SOURCE_CODE_LENGTH:
             logger.warning(
-                f"Skipping {json_path.stem} because it exceeds the maximum length of {MAX_SOURCE_CODE_LENGTH} tokens."
+                f"Skipping {json_path.stem} because it exceeds the maximum length of {MAX_SOURCE_CODE_LENGTH} characters."
             )
             continue
 
+        # Skip if we've already collected this response:
+        if json_path in already_collected:
+            continue
+
+        subdirectory.mkdir(exist_ok=True)
+
         request = dict(
             model=MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": make_prompt_with_context(code, pem)},
+                {
+                    "role": "user",
+                    "content": make_prompt_with_context(code, error_message),
+                },
             ],
             temperature=0,
         )
 
-        response = openai.ChatCompletion.create(**request)
-
-        with json_path.open(mode="w") as json_file:
-            # Provide enough information to reconstruct the original scenario:
-            json.dump(
-                dict(
-                    type="error-only",
-                    # Although these results are (sort of) independent of the exact source file and error,
-                    # it's useful to know exactly which file induced this error, particularly for the
-                    # error messages that have an identifier in them, e.g., cannot find symbol  -  variable foo
-                    srcml_path=srcml_path,
-                    version=version,
-                    pem_category=category,
-                    request=request,
-                    response=response.to_dict(),
-                ),
-                json_file,
+        # Provide enough information to reconstruct the original scenario:
+        record = dict(
+            type="error-only",
+            # Although these results are (sort of) independent of the exact source file and error,
+            # it's useful to know exactly which file induced this error, particularly for the
+            # error messages that have an identifier in them, e.g., cannot find symbol  -  variable foo
+            srcml_path=srcml_path,
+            version=version,
+            pem_category=category,
+            request=request,
+        )
+        pending_requests[json_path] = record
+
+    await fetch_responses(pending_requests)
+
+
+async def fetch_responses(pending_requests: Dict[Path, Dict[str, Any]]) -> None:
+    """
+    Issues the API calls for all the pending requests concurrently. Each response is
+    saved to its JSON file as soon as it comes in, so if something goes wrong, we can
+    rerun the script and only pay for the responses we're still missing.
+    """
+    # Identical deterministic requests (e.g., duplicate submissions) only need to be sent
+    # once; the response is then written to every JSON file that asked for it:
+    requests_by_key: Dict[str, List[Tuple[Path, Dict[str, Any]]]] = {}
+    for json_path, record in pending_requests.items():
+        request = record["request"]
+        key = request_key(request) if is_cacheable(request) else str(json_path)
+        requests_by_key.setdefault(key, []).append((json_path, record))
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def fetch_response(records: List[Tuple[Path, Dict[str, Any]]]) -> None:
+        async with semaphore:
+            response = await cached_chat_completion(records[0][1]["request"])
+
+        for json_path, record in records:
+            write_atomically(json_path, dump_json(dict(record, response=response)))
+
+    tasks = [fetch_response(records) for records in requests_by_key.values()]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+        await task
+
+
+async def cached_chat_completion(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the response to a ChatCompletion request as a dictionary.
+
+    Responses are cached on disk by the content of the request (model, messages,
+    temperature, etc.), so an identical request is only ever sent once. Requests with a
+    non-zero temperature are non-deterministic by design, so those are never cached.
+    """
+    if not is_cacheable(request):
+        return await chat_completion(request)
+
+    key = request_key(request)
+    cache_path = LLM_CACHE_DIR / key[:2] / f"{key}.json"
+
+    if cache_path.exists():
+        return json.loads(cache_path.read_bytes())
+
+    response = await chat_completion(request)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomically(cache_path, dump_json(response))
+
+    return response
+
+
+async def chat_completion(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Actually sends a ChatCompletion request, throttled by RATE_LIMITER, and retries with
+    exponential backoff if we get rate limited anyway.
+    """
+    estimated_tokens = estimate_tokens(request)
+    for attempt in range(MAX_RETRIES + 1):
+        await RATE_LIMITER.acquire(estimated_tokens)
+        try:
+            response = await openai.ChatCompletion.acreate(**request)
+        except openai.error.RateLimitError:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = 2**attempt + random.random()
+            logger.warning(f"Rate limited; retrying in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+        else:
+            return response.to_dict()
+
+    raise AssertionError("unreachable")
+
+
+class RateLimiter:
+    """
+    Throttles API calls so that they stay under both the request and the token rate limits.
+    Capacity replenishes continuously, up to one minute's worth.
+
+    Adapted from https://github.com/openai/openai-cookbook/blob/main/examples/api_request_parallel_processor.py
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.max_requests = float(requests_per_minute)
+        self.max_tokens = float(tokens_per_minute)
+        self.available_requests = self.max_requests
+        self.available_tokens = self.max_tokens
+        self.last_update = time.monotonic()
+
+    async def acquire(self, tokens: int) -> None:
+        "Waits until there is enough capacity for one request of the given size."
+        # A request bigger than a minute's worth of tokens would wait forever:
+        needed_tokens = min(tokens, self.max_tokens)
+        while True:
+            self._replenish()
+            if self.available_requests >= 1 and self.available_tokens >= needed_tokens:
+                # There's no await between checking and taking, so no lock is needed:
+                self.available_requests -= 1
+                self.available_tokens -= needed_tokens
+                return
+
+            missing_requests = max(0.0, 1 - self.available_requests)
+            missing_tokens = max(0.0, needed_tokens - self.available_tokens)
+            await asyncio.sleep(
+                60
+                * max(
+                    missing_requests / self.max_requests,
+                    missing_tokens / self.max_tokens,
+                )
             )
 
+    def _replenish(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self.last_update) / 60
+        self.last_update = now
+        self.available_requests = min(
+            self.max_requests,
+            self.available_requests + elapsed_minutes * self.max_requests,
+        )
+        self.available_tokens = min(
+            self.max_tokens,
+            self.available_tokens + elapsed_minutes * self.max_tokens,
+        )
+
+
+RATE_LIMITER = RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """
+    Roughly estimates how many tokens a request will use, without needing a tokenizer.
+    English text averages about 4 characters per token.
+    """
+    characters = sum(len(message["content"]) for message in request["messages"])
+    return characters // 4 + 1
+
+
+def is_cacheable(request: Dict[str, Any]) -> bool:
+    "Only deterministic (temperature=0) requests have a single, reusable response."
+    return request.get("temperature", 1) <= 0
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    "Returns a key that is the same for any two requests with identical content."
+    request_json = json.dumps(request, sort_keys=True)
+    return hashlib.sha256(request_json.encode("UTF-8")).hexdigest()
+
+
+def existing_json_files(directory: Path) -> Set[Path]:
+    """
+    Returns the paths of all JSON files in directory (and its subdirectories).
+
+    Listing each directory once is much cheaper than stat'ing every would-be
+    json_path, especially on a slow network filesystem.
+    """
+    found: Set[Path] = set()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                found |= existing_json_files(Path(entry.path))
+            elif entry.name.endswith(".json"):
+                found.add(Path(entry.path))
+    return found
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """
+    Writes to a temporary file and then moves it into place, so that a crash never leaves
+    a half-written file behind (which would be mistaken for a finished response on rerun).
+    """
+    fd, temporary_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    # mkstemp() makes the file private, but these files are meant to be shared:
+    os.chmod(temporary_path, 0o644)
+    with open(fd, mode="wb") as temporary_file:
+        temporary_file.write(data)
+    os.replace(temporary_path, path)
+
+
+def dump_json(data: Dict[str, Any]) -> bytes:
+    "Serializes data as UTF-8 encoded JSON (using orjson, if it's available)."
+    if orjson is not None:
+        return orjson.dumps(data)
+    # Compact, just like orjson's output:
+    return json.dumps(data, separators=(",", ":")).encode("UTF-8")
+
 
 def numbererd_scenarios():
     """
     Yield all scenarios. Each scenario includes its error message category,
-    its rank (n) and the scenario's index within its category (k).
+    the category's name, prefixed with its rank (n), e.g., "02-';' expected",
+    and the scenario's index within its category (k).
 
     I factored this out as a generator, because, although this could all
     be done in a single for loop, you don't want to see what that looks like!
     """
-    for n, (category, group) in enumerate(
-        groupby(ALL_SCENARIOS, key=by_pem_category), start=1
-    ):
+    for category_name, category, group in scenarios_by_category():
         for k, scenario in enumerate(group, start=1):
-            yield n, k, category, scenario
+            yield category_name, k, category, scenario
+
+
+def error_only_scenarios():
+    """
+    Like numbererd_scenarios(), but only yields the scenarios that need their own
+    error-only response. Categories without placeholders produce the same message every
+    time, so only their first scenario is needed.
+    """
+    for category_name, category, group in scenarios_by_category():
+        if category in CATEGORIES_WITH_PLACEHOLDERS:
+            for k, scenario in enumerate(group, start=1):
+                yield category_name, k, category, scenario
+        else:
+            yield category_name, 1, category, group[0]
+
+
+async def main() -> None:
+    # Share one HTTP session (and its connection pool) between all API calls, instead of
+    # letting openai open a new session for every request:
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        openai.aiosession.set(session)
+        # Collect responses for error-only prompts
+        await collect_error_only_responses()
+        # Collect responses for error with context prompts
+        await collect_error_with_context_responses()
 
 
 if __name__ == "__main__":
-    # Collect responses for error-only prompts
-    collect_error_only_responses()
-    # Collect responses for error with context prompts
-    collect_error_with_context_responses()
+    asyncio.run(main())
@@ -25,13 +25,29 @@ SEE ALSO:
 
 import json
 import pickle
+import pickletools
 from pathlib import Path
 
+try:
+    # orjson is a lot faster at reading JSON, but it's not required:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
 # Where we can find the data:
 HERE = Path(__file__).parent
 ERROR_ONLY = HERE / "llm" / "error-only"
 CODE_AND_CONTEXT_ONLY = HERE / "llm" / "error-with-context"
 
+
+def load_json(json_path: Path):
+    "Loads one JSON file (using orjson, if it's available)."
+    # Read as bytes, so that the JSON is always decoded as UTF-8:
+    if orjson is not None:
+        return orjson.loads(json_path.read_bytes())
+    return json.loads(json_path.read_bytes())
+
+
 # We will store the full JSON in a dictionary, but for the purposes of rating
 # PEMs, this data is superfluous.
 raw = {
@@ -45,8 +61,7 @@ error_only_messages = {}
 error_only_messages_by_scenario = {}
 
 for json_path in ERROR_ONLY.glob("**/*.json"):
-    with json_path.open() as json_file:
-        data = json.load(json_file)
+    data = load_json(json_path)
 
     pem_category = data["pem_category"]
     srcml_path = data["srcml_path"]
@@ -62,8 +77,7 @@ for json_path in ERROR_ONLY.glob("**/*.json"):
 # This maps (srcml_path, version) to plain text (which can be interpreted as Markdown)
 code_and_data_messages = {}
 for json_path in CODE_AND_CONTEXT_ONLY.glob("**/*.json"):
-    with json_path.open() as json_file:
-        data = json.load(json_file)
+    data = load_json(json_path)
 
     srcml_path = data["srcml_path"]
     version = data["version"]
@@ -73,13 +87,12 @@ for json_path in CODE_AND_CONTEXT_ONLY.glob("**/*.json"):
     code_and_data_messages[(srcml_path, version)] = text
 
 # Pickle it!
+llm_results = {
+    "error_only": error_only_messages,
+    "error_only_by_scenario": error_only_messages_by_scenario,
+    "code_and_context": code_and_data_messages,
+    "_raw": raw,
+}
 with open("llm.pickle", "wb") as f:
-    pickle.dump(
-        {
-            "error_only": error_only_messages,
-            "error_only_by_scenario": error_only_messages_by_scenario,
-            "code_and_context": code_and_data_messages,
-            "_raw": raw,
-        },
-        f,
-    )
+    # Protocol 5 + optimize() makes for a smaller pickle that's faster to load:
+    f.write(pickletools.optimize(pickle.dumps(llm_results, protocol=5)))
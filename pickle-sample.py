@@ -19,15 +19,25 @@ SEE ALSO:
 """
 
 import pickle
+import pickletools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 from blackbox_mini import JavaUnit
 
-sample_with_source_code = []
-with open("sample.tsv") as sample_tsv:
-    for line in sample_tsv:
-        pem_category, xml_filename, version = line.rstrip().split("\t")
-        unit = JavaUnit.from_path_and_version(xml_filename, version)
-        sample_with_source_code.append(
+
+def load_scenarios(
+    xml_filename: str, rows: List[Tuple[int, str, str]]
+) -> List[Tuple[int, dict]]:
+    """
+    Fetches the source code of every scenario from the same srcML file, parsing the file
+    only once. Each row is (line number, pem_category, version).
+    """
+    units = JavaUnit.from_path_and_versions(xml_filename, [row[2] for row in rows])
+    return [
+        (
+            line_number,
             dict(
                 pem_category=pem_category,
                 # NOTE: [2023-05-11] This should be called "srcml_path", but it's too
@@ -35,9 +45,42 @@ with open("sample.tsv") as sample_tsv:
                 # "srcml_path" instead.
                 xml_filename=xml_filename,
                 version=version,
-                unit=unit,
+                unit=units[version],
+            ),
+        )
+        for line_number, pem_category, version in rows
+    ]
+
+
+if __name__ == "__main__":
+    # Several versions of the same srcML file may be sampled, so group them by file:
+    rows_by_file: Dict[str, List[Tuple[int, str, str]]] = {}
+    with open("sample.tsv") as sample_tsv:
+        for line_number, line in enumerate(sample_tsv):
+            pem_category, xml_filename, version = line.rstrip().split("\t")
+            rows_by_file.setdefault(xml_filename, []).append(
+                (line_number, pem_category, version)
             )
+
+    # Every srcML file can be parsed independently, so they are parsed in parallel.
+    # The scenarios are put back in the same order as sample.tsv:
+    sample_with_source_code: List[Optional[dict]] = [None] * sum(
+        map(len, rows_by_file.values())
+    )
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(
+            load_scenarios, rows_by_file.keys(), rows_by_file.values(), chunksize=32
         )
+        for scenarios in results:
+            for line_number, scenario in scenarios:
+                # The same categories (and files) come up again and again. When they are
+                # the very same str objects, the pickle only stores each one once:
+                scenario["pem_category"] = sys.intern(scenario["pem_category"])
+                scenario["xml_filename"] = sys.intern(scenario["xml_filename"])
+                sample_with_source_code[line_number] = scenario
 
-with open("sample.pickle", "wb") as sample_pickle:
-    pickle.dump(sample_with_source_code, sample_pickle)
+    with open("sample.pickle", "wb") as sample_pickle:
+        # Protocol 5 + optimize() makes for a smaller pickle that's faster to load:
+        sample_pickle.write(
+            pickletools.optimize(pickle.dumps(sample_with_source_code, protocol=5))
+        )
@@ -29,16 +29,16 @@ import pickle
 import sys
 import textwrap
 import typing
-from itertools import groupby
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Literal, Sequence, TypedDict
+from typing import Any, Dict, List, Literal, Sequence, Tuple, TypedDict
 
 import questionary
 from pygments import highlight
 from pygments.formatters import TerminalFormatter
 from pygments.lexers import JavaLexer
 from questionary import Choice, ValidationError
-from rich import print
+from rich import get_console, print
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.text import Text
@@ -146,33 +146,53 @@ def print_with_javac_pem(unit: JavaUnit) -> None:
     pem = unit.pems[0]
     pem_line_no = pem.start.line
 
+    # Printing line-by-line is slow, so render every line first, then print them all at
+    # once. rich.print() renders strings using rich's global console (NOT our console):
+    render_str = get_console().render_str
+    output_lines = []
+    # The width of the gutter is the same for every line, so only build these once:
+    format_line_no = f"{{:>{biggest_line_no_width}}}".format
+    margin = " " * biggest_line_no_width
+
     for line_no, ansi_line in enumerate(source_lines, start=1):
         on_pem_line = line_no == pem_line_no
-        line = Text.from_ansi(ansi_line)
+        line = ansi_to_text(ansi_line)
 
         if not on_pem_line:
             # Ordinary line:
-            print(f"{line_no:>{biggest_line_no_width}} | ", end="")
-            print(line)
+            output_lines.append(render_str(f"{format_line_no(line_no)} | ") + line)
             continue
 
         # Priting the error message:
-        print(f"[red]{pem.filename}: error: [bold]{pem.fixed_error_message_text}")
+        output_lines.append(
+            render_str(
+                f"[red]{pem.filename}: error: [bold]{pem.fixed_error_message_text}"
+            )
+        )
         # Print the line containing the error:
-        print(f"[bold red]{line_no:>{biggest_line_no_width}}[/bold red] | ", end="")
-        print(line)
+        output_lines.append(
+            render_str(f"[bold red]{format_line_no(line_no)}[/bold red] | ") + line
+        )
 
         # Columns are 1-indexed (annoyingly):
         padding = (pem.start.column - 1) * " "
-        margin = " " * biggest_line_no_width
 
         # Print the caret (looks like a red, squiggly underline):
         if pem.start.line == pem.end.line:
             marker = "^" * max(1, pem.end.column - pem.start.column)
         else:
             marker = "^"
-        print(f"{margin} | {padding}[red]{marker}[/red]")
-        print(f"{margin} |")
+        output_lines.append(render_str(f"{margin} | {padding}[red]{marker}[/red]"))
+        output_lines.append(render_str(f"{margin} |"))
+
+    print(Text("\n").join(output_lines))
+
+
+# Many lines are highlighted exactly the same (blank lines, closing braces, etc.), so
+# remember their parsed Text. NOTE: the Text is shared, so don't modify it in-place!
+@lru_cache(maxsize=4096)
+def ansi_to_text(ansi_line: str) -> Text:
+    return Text.from_ansi(ansi_line)
 
 
 def print_source_code(scenario: Scenario):
@@ -279,63 +299,76 @@ def ask_about_variant(scenario, variant: Variant) -> Answers:
             print("Okay, we'll try that again!")
 
 
-def ask_about_variant_once(scenario, variant: Variant) -> Answers:
-    """
-    Ask the user to rate a scenario under a particular variant.
+def message_for_variant(scenario, variant: Variant) -> str:
     """
-    unit = scenario["unit"]
-
-    console.rule(
-        f"[bold]Rate this {variant} error message for the above context[/bold]:"
-    )
-
-    # All the PEMs use the original javac error message:
-    javac_error_message = unit.pems[0].fixed_error_message_text
-
-    # Show the original javac message for reference:
-    if variant in ("gpt-4-error-only", "gpt-4-with-context"):
-        print("[grey62 italic]Note: This is the original javac error message:")
-        markdown_safe = javac_error_message.replace("<", "\<").replace(">", "\>")
-        message_as_md_quote = textwrap.indent(markdown_safe, "> ")
-        md = Markdown(message_as_md_quote)
-        console.print(md)
-        print()
+    Returns the error message that is shown for the scenario under the given variant.
 
+    Raises EnhancedMessageDoesNotExistException if it was never generated.
+    """
     # I know, I know, it should be "srcml_path", but I accidentally
     # changed it to "xml_filename" in sample.pickle, so here we are:
     scenario_id = (scenario["xml_filename"], scenario["version"])
 
     if variant == "javac":
-        message = javac_error_message
-        print(javac_error_message)
+        # All the PEMs use the original javac error message:
+        return scenario["unit"].pems[0].fixed_error_message_text
     elif variant == "gpt-4-error-only":
         # Try getting the message for the specific scenario first...
-        message = GPT4_ERROR_ONLY_RESPONSES.get(scenario_id)
+        message = llm_results()["error_only_by_scenario"].get(scenario_id)
         # ...if that fails, get the generic response applicable to all messages in the
         # category:
         if message is None:
-            message = GPT4_ERROR_ONLY_GENERIC_RESPONSES[scenario["pem_category"]]
-        md = Markdown(message)
-        console.print(md)
+            message = llm_results()["error_only"][scenario["pem_category"]]
+        return message
     elif variant == "gpt-4-with-context":
-        message = GPT4_CONTEXTUAL_RESPONSES.get(scenario_id)
+        message = llm_results()["code_and_context"].get(scenario_id)
         if message is None:
             raise EnhancedMessageDoesNotExistException(
                 "The source code context was too large to query GPT-4."
             )
-        md = Markdown(message)
-        console.print(md)
+        return message
     elif variant == "decaf":
-        message = DECAF_RESPONSES.get(scenario_id)
+        message = decaf_responses().get(scenario_id)
         if message is None:
             raise EnhancedMessageDoesNotExistException(
                 "Decaf crashed while trying to enhance this message."
             )
+        return message
+    else:
+        raise ValueError(f"Unknown configuration: {variant!r}")
 
-        md = Markdown(message)
+
+def ask_about_variant_once(scenario, variant: Variant) -> Answers:
+    """
+    Ask the user to rate a scenario under a particular variant.
+    """
+    unit = scenario["unit"]
+
+    # Look up the message first, so that a missing message is reported before
+    # anything else is printed:
+    message = message_for_variant(scenario, variant)
+
+    console.rule(
+        f"[bold]Rate this {variant} error message for the above context[/bold]:"
+    )
+
+    # All the PEMs use the original javac error message:
+    javac_error_message = unit.pems[0].fixed_error_message_text
+
+    # Show the original javac message for reference:
+    if variant in ("gpt-4-error-only", "gpt-4-with-context"):
+        print("[grey62 italic]Note: This is the original javac error message:")
+        markdown_safe = javac_error_message.replace("<", "\<").replace(">", "\>")
+        message_as_md_quote = textwrap.indent(markdown_safe, "> ")
+        md = Markdown(message_as_md_quote)
         console.print(md)
+        print()
+
+    if variant == "javac":
+        print(message)
     else:
-        raise ValueError(f"Unknown configuration: {variant!r}")
+        md = Markdown(message)
+        console.print(md)
 
     # Ask all the questions!
     console.rule()
@@ -471,6 +504,22 @@ def ask_questions_for_current_variant() -> Answers:
     return answers
 
 
+# The enhanced messages are only needed once we get to a variant that shows them, so
+# they're loaded on first use rather than before the rater can even start:
+@lru_cache(maxsize=None)
+def llm_results() -> Dict[str, Dict[Any, str]]:
+    "Returns the GPT-4 responses from llm.pickle (see pickle-llm-results.py)."
+    with open(HERE / "llm.pickle", "rb") as llm_file:
+        return pickle.load(llm_file)
+
+
+@lru_cache(maxsize=None)
+def decaf_responses() -> Dict[Tuple[str, str], str]:
+    "Returns the Decaf responses from decaf.pickle (see enhance-using-decaf.py)."
+    with open(HERE / "decaf.pickle", "rb") as decaf_file:
+        return pickle.load(decaf_file)
+
+
 ### The script starts here ###
 
 with open(HERE / "sample.pickle", "rb") as sample_file:
@@ -481,16 +530,6 @@ ALL_SCENARIOS = {
     for scenario in _ALL_SCENARIOS
 }
 
-with open(HERE / "llm.pickle", "rb") as llm_file:
-    LLM_RESULTS = pickle.load(llm_file)
-
-GPT4_ERROR_ONLY_GENERIC_RESPONSES = LLM_RESULTS["error_only"]
-GPT4_ERROR_ONLY_RESPONSES = LLM_RESULTS["error_only_by_scenario"]
-GPT4_CONTEXTUAL_RESPONSES = LLM_RESULTS["code_and_context"]
-
-with open(HERE / "decaf.pickle", "rb") as decaf_file:
-    DECAF_RESPONSES = pickle.load(decaf_file)
-
 # Set up the database.
 db = Database("answers.sqlite3")
 answers_table = db["answers"].create(  # type: ignore
@@ -542,12 +581,12 @@ def assignments_grouped_by_unit(assignments):
     presented one after the other.
     """
 
-    def by_unit(assignment):
-        srcml_path, version, _variant = assignment
-        return srcml_path, version
+    variants_by_unit: Dict[Tuple[str, str], List[Variant]] = {}
+    for srcml_path, version, variant in assignments:
+        variants_by_unit.setdefault((srcml_path, version), []).append(variant)
 
-    for (srcml_path, version), group in groupby(sorted(assignments), by_unit):
-        variants = [x[2] for x in group]
+    # Present the units in a consistent order (sets are NOT ordered consistently!):
+    for (srcml_path, version), variants in sorted(variants_by_unit.items()):
         yield srcml_path, version, sorted_variants(variants)
 
 
@@ -0,0 +1,63 @@
+"""
+Tests for blackbox_mini.
+"""
+
+import copyreg
+import io
+import pickle
+import unittest
+import xml.etree.ElementTree
+
+from blackbox_mini import JavaUnit
+
+SRCML_UNIT = """<unit version="100" compile-success="false"><class start="3:1">\
+<specifier>public</specifier> class <name>Foo</name><block>{
+    int x = 1
+}</block></class>
+<compile-error start="4:14" end="4:15">';' expected</compile-error>
+</unit>"""
+
+
+class OldStylePickler(pickle.Pickler):
+    """
+    Pickles JavaUnits the way pickles were written before JavaUnit had __getstate__,
+    i.e., with the unit as an xml.etree element.
+    """
+
+    def reducer_override(self, obj):
+        if type(obj) is JavaUnit:
+            return (copyreg.__newobj__, (JavaUnit,), obj.__dict__.copy())
+        return NotImplemented
+
+
+def old_style_pickle(obj) -> bytes:
+    f = io.BytesIO()
+    OldStylePickler(f).dump(obj)
+    return f.getvalue()
+
+
+class TestPickleJavaUnit(unittest.TestCase):
+    def setUp(self):
+        self.original = JavaUnit.from_unit(xml.etree.ElementTree.fromstring(SRCML_UNIT))
+
+    def test_repickle_old_pickle(self):
+        "A unit from an old pickle can be pickled again, even when using lxml."
+        from_old_pickle = pickle.loads(old_style_pickle(self.original))
+        repickled = pickle.loads(pickle.dumps(from_old_pickle))
+
+        self.assertEqual(repickled.filename, "Foo.java")
+        self.assertEqual(repickled.pems, self.original.pems)
+        self.assertEqual(repickled.source_code, self.original.source_code)
+
+    def test_pickle_round_trip(self):
+        repickled = pickle.loads(
+            pickle.dumps(pickle.loads(pickle.dumps(self.original)))
+        )
+
+        self.assertEqual(repickled.filename, self.original.filename)
+        self.assertEqual(repickled.pems, self.original.pems)
+        self.assertEqual(repickled.source_code, self.original.source_code)
+
+
+if __name__ == "__main__":
+    unittest.main()